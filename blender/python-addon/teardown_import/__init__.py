@@ -18,6 +18,7 @@ from bpy.types import Operator, AddonPreferences
 from bpy.props import StringProperty
 from mathutils import Matrix, Vector, Euler, Color
 import bmesh
+import numpy as np
 from nodeitems_utils import NodeItem, register_node_categories, unregister_node_categories
 from nodeitems_builtins import ShaderNodeCategory, CompositorNodeCategory
 
@@ -37,20 +38,22 @@ def make_vertex_list_printable(vertex_list):
     return list(map(lambda x: x.co.to_tuple(), vertex_list))
 
 def max_one_vector(v):
-    return Vector((sorted((-1, v.x, 1))[1], sorted((-1, v.y, 1))[1], sorted((-1, v.z, 1))[1]))
+    return Vector((max(-1.0, min(1.0, v.x)), max(-1.0, min(1.0, v.y)), max(-1.0, min(1.0, v.z))))
+
+# These also take (n, 3) arrays of vectors, but return a Vector for a single one
+
+def as_vector_if_single(result):
+    return Vector(result) if np.ndim(result) == 1 else result
 
 def signum(n):
-    return math.copysign(1, n)
+    return np.copysign(1.0, n)
 
 def flip_with(v, w):
-    return Vector((signum(v.x*w.x), signum(v.y*w.y), signum(v.z*w.z)))
+    return as_vector_if_single(signum(np.multiply(v, w)))
 
 def replace_if_not_zero(v, w):
-    v = v.copy()
-    for i, x in enumerate(w):
-        if x != 0:
-            v[i] = x
-    return v
+    w = np.asarray(w)
+    return as_vector_if_single(np.where(w != 0, w, v))
 
 # pub struct Entity<'a> {
 #     pub handle: u32,
@@ -61,11 +64,9 @@ def replace_if_not_zero(v, w):
 # }
 
 def get_entity_name(entity):
-    s = ""
     if entity["desc"] != "":
-        s += entity["desc"] + " "
-    s += str(entity["handle"]) + " " + entity["kind"][0]
-    return s
+        return f'{entity["desc"]} {entity["handle"]} {entity["kind"][0]}'
+    return f'{entity["handle"]} {entity["kind"][0]}'
 
 # pub struct Light<'a> {
 #     pub unknown_starting_byte: u8,
@@ -89,98 +90,112 @@ def get_entity_name(entity):
 # pub enum Kind {
 #     Sphere = 1,Cone = 2,Area = 3,}
 
-def gen_chunk_coords(dimensions):
-    for z in range(dimensions[2]):
-        for y in range(dimensions[1]):
-            for x in range(dimensions[0]):
-                yield (x, y, z)
-    yield (0, 0, 0)
-
-
-def iter_chunks(seq, size):
-    return (seq[pos:pos + size] for pos in range(0, len(seq), size))
-
-def unpack_positions(positions):
-    for i in range(0, len(positions), 3):
-        yield (positions[i], positions[i+1], positions[i+2])
-
+def make_point_light(name, data):
+    light = bpy.data.lights.new(name, "POINT")
+    rgba = data["rgba"]
+    #print(rgba)
+    light.color = (rgba["r"], rgba["g"], rgba["b"])
+    return light
+
+def make_spot_light(name, data):
+    light = bpy.data.lights.new(name, "SPOT")
+    angle = data["cone_angle"]["radians"]
+    penumbra = data["cone_penumbra"]["radians"]
+    #print(data)
+    light.spot_size = angle
+    light.spot_blend = penumbra / angle
+    return light
+
+def make_area_light(name, data):
+    return bpy.data.lights.new(name, "AREA")
+
+light_factories = {
+    "Sphere": make_point_light,
+    "Cone": make_spot_light,
+    "Area": make_area_light,
+}
 
 n_shapes = 0
 tot_n_voxels = 0
 
 tot_n_objects = 0
 def create_object(entity, collection):
+    root_obj = None
+    created_objects = []
+    stack = [(entity, None)]
+    while stack:
+        entity, parent = stack.pop()
+        obj = _create_one(entity)
+        created_objects.append(obj)
+        if root_obj is None:
+            root_obj = obj
+        if parent is not None:
+            obj.parent = parent
+        #is_world_body = entity["kind"][0] == "Body" and len(entity["children"]) > 40
+        is_world_body = False
+        children_parent = None if is_world_body else obj
+        stack.extend((child, children_parent) for child in reversed(entity["children"]))
+    link = collection.objects.link
+    for obj in created_objects:
+        link(obj)
+    return root_obj
+
+def _create_one(entity):
     global tot_n_objects
     tot_n_objects += 1
     print("Creating object n " + str(tot_n_objects))
     (kind_name, data) = entity["kind"]
+    name = get_entity_name(entity)
     obj = None
     obj_data = None
     if kind_name == "Body":
         pass
     elif kind_name == "Light":
-        name = get_entity_name(entity) + " " + data["kind"][0].lower()
+        light_name = f'{name} {data["kind"][0].lower()}'
         light_kind = data["kind"][0]
-        if light_kind == "Sphere":
-            light = bpy.data.lights.new(name, "POINT")
-            rgba = data["rgba"]
-            #print(rgba)
-            light.color = (rgba["r"], rgba["g"], rgba["b"])
-        elif light_kind == "Cone":
-            light = bpy.data.lights.new(name, "SPOT")
-            angle = data["cone_angle"]["radians"]
-            penumbra = data["cone_penumbra"]["radians"]
-            #print(data)
-            light.spot_size = angle
-            light.spot_blend = penumbra / angle
-        elif light_kind == "Area":
-            light = bpy.data.lights.new(name, "AREA")
-        else:
-            raise "Unknown light kind " + light_kind
+        make_light = light_factories.get(light_kind)
+        if make_light is None:
+            raise ValueError("Unknown light kind " + light_kind)
+        light = make_light(light_name, data)
         # light.distance = data["reach"]
         light.energy = 100
         light.shadow_soft_size = data["size"]
         obj_data = light
     elif kind_name == "Shape":
-        n_voxels = int(len(data["voxel_positions"]) / 3)
+        n_voxels = len(data["voxel_positions"]) // 3
         global tot_n_voxels
         tot_n_voxels += n_voxels
-        if len(data["voxel_positions"]) != 0 and not (n_voxels > 1024*8 or n_voxels > 500000):
+        if 0 < n_voxels <= 1024*8:
             
             # global n_shapes
             # n_shapes += 1
             # print(n_shapes)
             # if n_shapes > 2:
-            #     return bpy.data.meshes.new(get_entity_name(entity) + " weird mesh")
+            #     return bpy.data.meshes.new(name + " weird mesh")
 
-            # bm = bmesh.new()
             # # trans = Matrix.Translation(Vector((0.5, 0.5, 0.5)))
             # # diag = Matrix.Diagonal((data["size"][0], data["size"][1], data["size"][2], 0.0))
             # # scale = Matrix.Scale(0.1, 4)
-            # chunk_coords = gen_chunk_coords(data["size"])
-            # i = 0
-            # for (n_times, palette_index) in iter_chunks(data["voxel_data"], 2):
-            #     for _ in range(n_times+1):
-            #         i += 1
-            #         try:
-            #             coord = next(chunk_coords)
-            #         except:
-            #             print("Ran out of coordinates...")
-            #             print("size: ", data["size"])
-            #             return bpy.data.meshes.new(get_entity_name(entity) + " weird mesh")
-            #         if palette_index != 0:
-            #             bm.verts.new(coord)
-            # #bmesh.ops.create_cube(bm, size=1, matrix=scale @ diag @ trans)
-            # me = bpy.data.meshes.new(get_entity_name(entity) + " mesh")
-            # bm.to_mesh(me)
-            # bm.free()
-            me = bpy.data.meshes.new(get_entity_name(entity) + " mesh")
+            # from ._rle import decode_rle
+            # try:
+            #     palette_indices, coords = decode_rle(data["voxel_data"], data["size"])
+            # except ValueError:
+            #     print("Ran out of coordinates...")
+            #     print("size: ", data["size"])
+            #     return bpy.data.meshes.new(name + " weird mesh")
+            # me = bpy.data.meshes.new(name + " mesh")
+            # me.vertices.add(len(coords))
+            # me.vertices.foreach_set("co", coords.astype(np.float32).reshape(-1))
+            me = bpy.data.meshes.new(name + " mesh")
 
             me.vertices.add(n_voxels)
-            me.vertices.foreach_set("co", data["voxel_positions"])
+            # foreach_set can copy a float32 buffer directly instead of unboxing every float
+            positions = np.array(data["voxel_positions"], dtype=np.float32).reshape(-1)
+            # Scaled here rather than with me.transform to avoid a second pass over the vertices
+            positions *= 0.1
+            me.vertices.foreach_set("co", positions)
             # vertex_layer = me.vertex_layers_int.new(name="material")
             # vertex_layer.data.foreach_set("value", list(range(n_voxels)))
-            me.transform(Matrix.Scale(0.1, 4))
             # me.update()
             # color_layer = me.vertex_colors.new(name="material", do_init=False)
             # if len(data["voxel_materials"]) != 0:
@@ -188,18 +203,18 @@ def create_object(entity, collection):
             #         material = data["voxel_materials"][i]
             #         color_layer.data[i].color = (material / 256, 0, 0, 0)
 
-            obj = bpy.data.objects.new(get_entity_name(entity), me)
+            obj = bpy.data.objects.new(name, me)
             obj.modifiers.new("Skin", "SKIN")
-            for vertex in obj.data.skin_vertices[0].data:
-                vertex.radius = (0.05, 0.05)
+            radii = np.full(n_voxels*2, 0.05, dtype=np.float32)
+            obj.data.skin_vertices[0].data.foreach_set("radius", radii)
             # vertex_group = obj.vertex_groups.new(name="material")
             # for i, material in enumerate(data["voxel_materials"]):
             #     vertex_group.add([i], material / 256, "REPLACE")
         else:
-            obj_data = bpy.data.meshes.new(get_entity_name(entity) + " weird mesh")
+            obj_data = bpy.data.meshes.new(name + " weird mesh")
 
     if obj == None:
-        obj = bpy.data.objects.new(get_entity_name(entity), obj_data)
+        obj = bpy.data.objects.new(name, obj_data)
     if entity["transform"]:
         xyz = entity["transform"]["pos"]
         obj.location = (xyz[0], xyz[1], xyz[2])
@@ -207,15 +222,10 @@ def create_object(entity, collection):
         obj.rotation_mode = "QUATERNION"
         obj.rotation_quaternion = (xyzw[3], xyzw[0], xyzw[1], xyzw[2])
         # obj.matrix_local = Matrix.Rotation(math.radians(-90.0), 4, "X") @ Matrix(obj.matrix_world)
-    collection.objects.link(obj)
-    #is_world_body = entity["kind"][0] == "Body" and len(entity["children"]) > 40
-    is_world_body = False
-    for child in entity["children"]:
-        child_obj = create_object(child, collection)
-        if not is_world_body:
-            child_obj.parent = obj
     return obj
 
+material_lib_loaded = False
+
 bpy.types.Object.texture_tile = bpy.props.IntProperty(name="texture_tile", min=0, max=15)
 bpy.types.Object.texture_weight = bpy.props.FloatProperty(name="texture_weight", min=0, max=1)
 
@@ -226,9 +236,13 @@ class ImportBlockModel(Operator, ImportHelper):
     location: bpy.props.FloatVectorProperty(name="location", subtype="TRANSLATION")
 
     def execute(self, context):
-        hmm = os.path.join(os.path.dirname(__file__), "material.blend")
-        with bpy.data.libraries.load(hmm, link=True) as (data_from, data_to):
-            data_to.node_groups = data_from.node_groups
+        global material_lib_loaded
+        # Only link material.blend again if it hasn't been or the node group was removed
+        if not material_lib_loaded or "Teardown" not in bpy.data.node_groups:
+            hmm = os.path.join(os.path.dirname(__file__), "material.blend")
+            with bpy.data.libraries.load(hmm, link=True) as (data_from, data_to):
+                data_to.node_groups = [name for name in data_from.node_groups if name not in bpy.data.node_groups]
+            material_lib_loaded = True
         filepath = self.filepath
         # pack, resource_type, resource_id = resources.parse(filepath)
         # resources.packs.append(pack)
@@ -261,11 +275,13 @@ class ImportBlockModel(Operator, ImportHelper):
             #     obj = create_object(entity, collection)
             # bpy.context.collection.children.link(collection)
 
-        bpy.ops.object.select_all(action="DESELECT")
+        # Teardown is Y-up. Children follow their parents, so only the roots are rotated.
+        # matrix_world isn't evaluated yet, but without a parent it equals matrix_basis.
+        rotation = Matrix.Rotation(tau/4, 4, "X")
         for obj in collection.objects:
-            obj.select_set(True)
-        bpy.ops.transform.rotate(value=tau/4, center_override= (0, 0, 0), orient_axis='X', orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', constraint_axis=(True, False, False), mirror=True, use_proportional_edit=False, proportional_edit_falloff='SMOOTH', proportional_size=1, use_proportional_connected=False, use_proportional_projected=False)
-        bpy.ops.object.select_all(action="DESELECT")
+            if obj.parent is None:
+                obj.matrix_basis = rotation @ obj.matrix_basis
+        context.view_layer.update()
         # bpy.ops.transform.transform(mode="ROTATION", value=(tau/4, tau/4, tau/4, tau/4), orient_axis="X", orient_type="GLOBAL", center_override=(0, 0, 0))
         # scene.collection.children.link(collection)
         # empty_data = bpy.data.objects.new(str(resource_id), None)
@@ -0,0 +1,67 @@
+import numpy as np
+
+# Voxel data is a sequence of (n_times, palette_index) byte pairs, each run
+# covering n_times + 1 voxels in x, then y, then z order. Palette index 0 is
+# empty space.
+
+def _decode_rle_loop(voxel_data, size):
+    size_x, size_y, size_z = size
+    n_runs = voxel_data.shape[0] // 2
+    n_total = 0
+    n_solid = 0
+    for run in range(n_runs):
+        length = int(voxel_data[2*run]) + 1
+        n_total += length
+        if voxel_data[2*run + 1] != 0:
+            n_solid += length
+    if n_total > size_x*size_y*size_z:
+        raise ValueError("Voxel data has more voxels than the shape size")
+    palette_indices = np.empty(n_solid, dtype=np.uint8)
+    coords = np.empty((n_solid, 3), dtype=np.int32)
+    i = 0
+    out = 0
+    for run in range(n_runs):
+        length = int(voxel_data[2*run]) + 1
+        palette_index = voxel_data[2*run + 1]
+        if palette_index == 0:
+            i += length
+            continue
+        for _ in range(length):
+            rest, x = divmod(i, size_x)
+            z, y = divmod(rest, size_y)
+            palette_indices[out] = palette_index
+            coords[out, 0] = x
+            coords[out, 1] = y
+            coords[out, 2] = z
+            i += 1
+            out += 1
+    return palette_indices, coords
+
+def _decode_rle_numpy(voxel_data, size):
+    size_x, size_y, size_z = size
+    runs = voxel_data[:voxel_data.shape[0] // 2 * 2].reshape(-1, 2)
+    all_indices = np.repeat(runs[:, 1], runs[:, 0].astype(np.int64) + 1)
+    if all_indices.shape[0] > size_x*size_y*size_z:
+        raise ValueError("Voxel data has more voxels than the shape size")
+    solid = np.flatnonzero(all_indices)
+    z, rest = np.divmod(solid, size_x*size_y)
+    y, x = np.divmod(rest, size_x)
+    return all_indices[solid], np.stack((x, y, z), axis=-1).astype(np.int32)
+
+_decode = None
+
+def decode_rle(voxel_data, size):
+    # Returns the palette indices and (x, y, z) coordinates of the non-empty voxels
+    global _decode
+    if _decode is None:
+        # numba is not bundled with Blender, so only use it when installed
+        try:
+            from numba import njit
+            _decode = njit(cache=True)(_decode_rle_loop)
+        except ImportError:
+            _decode = _decode_rle_numpy
+    if isinstance(voxel_data, (bytes, bytearray, memoryview)):
+        voxel_data = np.frombuffer(voxel_data, dtype=np.uint8)
+    else:
+        voxel_data = np.asarray(voxel_data, dtype=np.uint8)
+    return _decode(voxel_data, tuple(int(dim) for dim in size))
@@ -0,0 +1,79 @@
+import importlib.util
+import os
+import sys
+import unittest
+
+import numpy as np
+
+# Loaded by path since importing the teardown_import package requires Blender
+spec = importlib.util.spec_from_file_location("_rle", os.path.join(os.path.dirname(__file__), "teardown_import", "_rle.py"))
+_rle = importlib.util.module_from_spec(spec)
+# Registered so that numba can find the module again when loading its cache
+sys.modules["_rle"] = _rle
+spec.loader.exec_module(_rle)
+
+def decode_brute_force(voxel_data, size):
+    palette_indices = []
+    coords = []
+    i = 0
+    for pos in range(0, len(voxel_data) - 1, 2):
+        n_times, palette_index = voxel_data[pos], voxel_data[pos + 1]
+        for _ in range(n_times + 1):
+            if palette_index != 0:
+                palette_indices.append(palette_index)
+                coords.append((i % size[0], i // size[0] % size[1], i // (size[0]*size[1])))
+            i += 1
+    return palette_indices, coords
+
+class DecodeRleTest(unittest.TestCase):
+    decoders = (_rle._decode_rle_loop, _rle._decode_rle_numpy)
+
+    def assert_decoders_match(self, voxel_data, size):
+        expected_indices, expected_coords = decode_brute_force(voxel_data, size)
+        array = np.frombuffer(voxel_data, dtype=np.uint8)
+        for decode in self.decoders:
+            palette_indices, coords = decode(array, size)
+            self.assertEqual(palette_indices.dtype, np.uint8)
+            self.assertEqual(coords.dtype, np.int32)
+            self.assertEqual(palette_indices.tolist(), expected_indices)
+            self.assertEqual(coords.reshape(-1, 3).tolist(), [list(coord) for coord in expected_coords])
+
+    def test_decoders_match(self):
+        rng = np.random.default_rng(0)
+        size = (7, 5, 3)
+        n_voxels = size[0]*size[1]*size[2]
+        runs = []
+        total = 0
+        while True:
+            n_times = int(rng.integers(0, 9))
+            if total + n_times + 1 > n_voxels:
+                break
+            runs += [n_times, int(rng.choice([0, 0, 1, 7, 255]))]
+            total += n_times + 1
+        self.assert_decoders_match(bytes(runs), size)
+
+    def test_long_runs(self):
+        self.assert_decoders_match(bytes([255, 3, 255, 0, 99, 9]), (20, 20, 2))
+
+    def test_empty(self):
+        self.assert_decoders_match(b"", (1, 1, 1))
+
+    def test_accepts_bytes(self):
+        palette_indices, coords = _rle.decode_rle(b"\x01\x00\x00\x05", (3, 1, 1))
+        self.assertEqual(palette_indices.tolist(), [5])
+        self.assertEqual(coords.tolist(), [[2, 0, 0]])
+
+    def test_too_many_voxels(self):
+        for decode in self.decoders:
+            with self.assertRaises(ValueError):
+                decode(np.array([3, 1], dtype=np.uint8), (2, 1, 1))
+
+@unittest.skipUnless(importlib.util.find_spec("numba"), "numba is not installed")
+class CompiledDecodeRleTest(DecodeRleTest):
+    @classmethod
+    def setUpClass(cls):
+        from numba import njit
+        cls.decoders = (njit(cache=True)(_rle._decode_rle_loop),)
+
+if __name__ == "__main__":
+    unittest.main()
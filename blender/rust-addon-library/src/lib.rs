@@ -7,11 +7,12 @@ use std::{
 
 use building_blocks::{core::Axis3Permutation, mesh::OrientedCubeFace, storage::GetMut};
 use indicatif::{ParallelProgressIterator, ProgressBar, ProgressIterator, ProgressStyle};
+use numpy::IntoPyArray;
 use pyo3::{exceptions, prelude::*, types::PyDict, wrap_pyfunction};
 use rayon::iter::{IntoParallelRefIterator, ParallelIterator};
 use teardown_bin_format::{
     light::Kind as LightKind, Entity, EntityKind, EntityKindVariants, Light, Material,
-    MaterialKind, Palette, Rgba, Scene, Shape, Transform,
+    MaterialKind, Palette, Rgba, Shape, Transform,
 };
 
 struct ImportContext<'a> {
@@ -64,13 +65,14 @@ impl BlenderMeshSpec {
         let n_polygons = self.polygon_vert_indices.len() as i32 / self.polygon_loop_total;
         py_loops.call_method1("add", (n_polygons * self.polygon_loop_total,))?;
         py_polygons.call_method1("add", (n_polygons,))?;
-        py_verts.call_method1("foreach_set", ("co", self.verts))?;
+        // Typed arrays let foreach_set copy the buffer instead of converting a list
+        py_verts.call_method1("foreach_set", ("co", self.verts.into_pyarray(py)))?;
         let mut update_loose_edges = false;
         if let Some(edges) = self.edges {
             assert_eq!(edges.len() as i32, n_verts / 3 * 2);
             let py_edges = mesh.getattr("edges")?;
             py_edges.call_method1("add", (edges.len() / 2,))?;
-            py_edges.call_method1("foreach_set", ("vertices", edges))?;
+            py_edges.call_method1("foreach_set", ("vertices", edges.into_pyarray(py)))?;
             update_loose_edges = true;
         }
         {
@@ -80,16 +82,24 @@ impl BlenderMeshSpec {
                 loop_totals.push(self.polygon_loop_total);
                 loop_starts.push(i * self.polygon_loop_total);
             }
-            py_polygons.call_method1("foreach_set", ("loop_total", loop_totals))?;
-            py_polygons.call_method1("foreach_set", ("loop_start", loop_starts))?;
+            py_polygons
+                .call_method1("foreach_set", ("loop_total", loop_totals.into_pyarray(py)))?;
+            py_polygons
+                .call_method1("foreach_set", ("loop_start", loop_starts.into_pyarray(py)))?;
         }
         assert_eq!(
             self.polygon_vert_indices.len() as i32 % self.polygon_loop_total,
             0
         );
-        py_polygons.call_method1("foreach_set", ("vertices", self.polygon_vert_indices))?;
+        py_polygons.call_method1(
+            "foreach_set",
+            ("vertices", self.polygon_vert_indices.into_pyarray(py)),
+        )?;
         if let Some(polygon_material_index) = self.polygon_material_index {
-            py_polygons.call_method1("foreach_set", ("material_index", polygon_material_index))?;
+            py_polygons.call_method1(
+                "foreach_set",
+                ("material_index", polygon_material_index.into_pyarray(py)),
+            )?;
         }
         let dict = PyDict::new(py);
         // Also calculates loops, so always neccessary
@@ -198,13 +208,40 @@ impl<'a> ImportContext<'a> {
         }
     }
 
+    /// Creates the objects for `entities` and all of their descendants
+    fn create_objects(
+        &mut self,
+        entities: &[Entity],
+        collection: &'a PyAny,
+        meshes: &mut HashMap<u32, BlenderMeshSpec>,
+    ) -> PyResult<()> {
+        let mut created_objects = Vec::new();
+        // A stack instead of recursion, since bodies can have deeply nested children
+        let mut stack: Vec<(&Entity, Option<&'a PyAny>)> =
+            entities.iter().rev().map(|entity| (entity, None)).collect();
+        while let Some((entity, parent)) = stack.pop() {
+            let obj = self.create_object(entity, meshes)?;
+            if let Some(parent) = parent {
+                obj.setattr("parent", parent)?;
+            }
+            created_objects.push(obj);
+            // Reversed so that children are created in order
+            stack.extend(entity.children.iter().rev().map(|child| (child, Some(obj))));
+        }
+        // Linked once the whole tree is built, with parents already set
+        let link = collection.getattr("objects")?.getattr("link")?;
+        for obj in created_objects {
+            link.call1((obj,))?;
+        }
+        Ok(())
+    }
+
+    /// Creates the object for a single entity, without its children
     fn create_object(
         &mut self,
         entity: &Entity,
-        collection: &'a PyAny,
-        parsed: &Scene,
         meshes: &mut HashMap<u32, BlenderMeshSpec>,
-    ) -> PyResult<&PyAny> {
+    ) -> PyResult<&'a PyAny> {
         self.entity_progress.inc(1);
         let mut obj: Option<&PyAny> = None;
         let mut obj_data: Option<&PyAny> = None;
@@ -292,14 +329,6 @@ impl<'a> ImportContext<'a> {
             self.new_object.call1((get_entity_name(entity), obj_data))?
         };
         set_transform(obj, entity.kind.transform())?;
-        collection
-            .getattr("objects")?
-            .getattr("link")?
-            .call1((obj,))?;
-        for child in &entity.children {
-            let child_obj = self.create_object(child, collection, parsed, meshes)?;
-            child_obj.setattr("parent", obj)?;
-        }
         Ok(obj)
     }
 
@@ -406,9 +435,7 @@ impl<'a> ImportContext<'a> {
             .collect::<HashMap<_, _>>();
 
         // Just the scene children
-        for entity in &parsed.entities {
-            self.create_object(entity, new_collection, &parsed, &mut shape_meshes)?;
-        }
+        self.create_objects(&parsed.entities, new_collection, &mut shape_meshes)?;
         let player_camera = self.new_camera.call1(("Player camera camera",))?;
         let tau = PI * 2.;
         player_camera.setattr("angle", tau / 4.)?;